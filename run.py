@@ -19,8 +19,12 @@ SRC_DIR = os.path.join(PROJECT_DIR, 'src')
 GRESOURCE_XML = os.path.join(SRC_DIR, 'adbee.gresource.xml')
 GRESOURCE_OUT = os.path.join(SRC_DIR, 'adbee.gresource')
 
-if not os.path.exists(GRESOURCE_OUT) or \
-   os.path.getmtime(GRESOURCE_XML) > os.path.getmtime(GRESOURCE_OUT):
+try:
+    out_mtime = os.stat(GRESOURCE_OUT).st_mtime
+except FileNotFoundError:
+    out_mtime = 0
+
+if out_mtime < os.stat(GRESOURCE_XML).st_mtime:
     print("Compiling gresource...")
     subprocess.run([
         'glib-compile-resources',
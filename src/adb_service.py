@@ -1,9 +1,14 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import asyncio
+import contextlib
+import re
 import secrets
 import shutil
+import socket
 import subprocess
 import time
+from enum import IntEnum
 from typing import Callable
 
 try:
@@ -13,6 +18,106 @@ except ImportError:
     HAS_ZEROCONF = False
 
 
+class AdbStatus(IntEnum):
+    """Estados de pareamento/conexão reportados por AdbService.on_status."""
+    WAITING = 0
+    PAIRED = 1
+    CONNECTED = 2
+
+
+# Endereço padrão do servidor adb
+ADB_SERVER_ADDRESS = ("127.0.0.1", 5037)
+
+# Cobre "connected to" e "already connected to" nas respostas do adb
+_CONN_RE = re.compile(rb"connected", re.I)
+
+# Argumentos fixos do subprocess.run de 'adb connect' (saída em bytes)
+_CONNECT_RUN_KW = {"capture_output": True, "timeout": 5}
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    """Lê exatamente 'size' bytes do socket."""
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("adb server closed the connection")
+        data += chunk
+    return data
+
+
+def _adb_request(cmd: bytes, timeout: float = 5) -> tuple[bool, bytes]:
+    """
+    Envia um serviço 'host:' direto ao servidor adb, sem executar o binário.
+    
+    Returns:
+        Tuple de (OKAY recebido, resposta do servidor)
+    """
+    with socket.create_connection(ADB_SERVER_ADDRESS, timeout=timeout) as sock:
+        sock.sendall(b"%04x%s" % (len(cmd), cmd))
+        status = _recv_exact(sock, 4)
+        length = int(_recv_exact(sock, 4), 16)
+        reply = _recv_exact(sock, length)
+    return status == b"OKAY", reply
+
+
+def _adb_connect(target: str) -> tuple[bool, bytes]:
+    """
+    Executa o equivalente a 'adb connect <target>'.
+    
+    Returns:
+        Tuple de (sucesso, saída bruta do adb)
+    """
+    try:
+        ok, output = _adb_request(f"host:connect:{target}".encode())
+        return ok and _CONN_RE.search(output) is not None, output
+    except ConnectionRefusedError:
+        # Servidor adb ainda não iniciado: 'adb connect' o inicia
+        pass
+    
+    process = subprocess.run(["adb", "connect", target], **_CONNECT_RUN_KW)
+    connected = process.returncode == 0 and (
+        _CONN_RE.search(process.stdout) is not None
+        or _CONN_RE.search(process.stderr) is not None
+    )
+    return connected, process.stdout or process.stderr
+
+
+async def _adb_connect_async(target: str) -> tuple[bool, bytes]:
+    """Versão assíncrona de _adb_connect, cancelável a qualquer momento."""
+    cmd = f"host:connect:{target}".encode()
+    try:
+        reader, writer = await asyncio.open_connection(*ADB_SERVER_ADDRESS)
+    except ConnectionRefusedError:
+        # Servidor adb ainda não iniciado: 'adb connect' o inicia
+        process = await asyncio.create_subprocess_exec(
+            "adb", "connect", target,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        connected = process.returncode == 0 and (
+            _CONN_RE.search(stdout) is not None
+            or _CONN_RE.search(stderr) is not None
+        )
+        return connected, stdout or stderr
+    
+    try:
+        writer.write(b"%04x%s" % (len(cmd), cmd))
+        await writer.drain()
+        status = await reader.readexactly(4)
+        length = int(await reader.readexactly(4), 16)
+        output = await reader.readexactly(length)
+    finally:
+        writer.close()
+    return status == b"OKAY" and _CONN_RE.search(output) is not None, output
+
+
 class AdbPairingListener(ServiceListener):
     """
     Listener para detectar quando o telefone inicia o serviço de pareamento.
@@ -24,11 +129,22 @@ class AdbPairingListener(ServiceListener):
     def __init__(self, pairing_code: str, on_paired: Callable[[str], None] | None = None):
         self.pairing_code = pairing_code
         self.on_paired = on_paired
+        # Última tentativa (ip:porta, código), para não repetir o mesmo 'adb pair'
+        self._last_attempt: tuple[str, str] | None = None
     
     def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         print(f"[mDNS] Service removed: {name}")
     
     def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
+        self._handle_service(zc, type_, name)
+    
+    def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
+        # O telefone sempre anuncia o mesmo nome (S:adbee). Se o registro
+        # anterior ainda estiver no cache do Zeroconf, um novo scan chega
+        # como update, não como add.
+        self._handle_service(zc, type_, name)
+    
+    def _handle_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         try:
             info: ServiceInfo | None = zc.get_service_info(type_, name)
             if info:
@@ -37,9 +153,6 @@ class AdbPairingListener(ServiceListener):
         except Exception as e:
             print(f"[mDNS] Error processing service '{name}': {e}")
     
-    def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        pass
-    
     def _pair_device(self, info: ServiceInfo) -> None:
         """Executa 'adb pair' quando um dispositivo é detectado."""
         try:
@@ -54,6 +167,12 @@ class AdbPairingListener(ServiceListener):
             ip_address = addresses[0].exploded
             port = info.port
             
+            # Updates de TXT/A do mesmo anúncio não devem repetir o pareamento
+            attempt = (f"{ip_address}:{port}", self.pairing_code)
+            if attempt == self._last_attempt:
+                return
+            self._last_attempt = attempt
+            
             cmd = ["adb", "pair", f"{ip_address}:{port}", self.pairing_code]
             # print(f"[ADB] Executing: {' '.join(cmd[:-1])} ******")
             
@@ -92,37 +211,56 @@ class AdbConnectListener(ServiceListener):
         self.auto_connect = auto_connect
         self.connected_devices = set()
         self.last_seen_service = None  # (ip, port)
+        # Endereço já resolvido por nome de serviço: nome -> (server, ip, porta).
+        # Vale enquanto o registro SRV (server, porta) não mudar.
+        self._addr_cache: dict[str, tuple[str, str, int]] = {}
     
     def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        pass
+        # Permitir reconectar se o dispositivo voltar no mesmo ip:porta
+        cached = self._addr_cache.pop(name, None)
+        if cached:
+            self.connected_devices.discard(f"{cached[1]}:{cached[2]}")
     
     def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
+        self._handle_service(zc, type_, name)
+    
+    def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
+        # Re-anúncios do mesmo nome chegam aqui, não em add_service
+        self._handle_service(zc, type_, name)
+    
+    def _handle_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         try:
             info: ServiceInfo | None = zc.get_service_info(type_, name)
             if info:
-                self._connect_device(info)
+                self._connect_device(name, info)
         except Exception as e:
             print(f"[mDNS] Error processing service '{name}': {e}")
     
-    def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        pass
-    
-    def _connect_device(self, info: ServiceInfo) -> None:
+    def _connect_device(self, name: str, info: ServiceInfo) -> None:
         """Conecta ao dispositivo quando o serviço de conexão é detectado."""
         if not self.auto_connect:
             print(f"[ADB] Auto-connect disabled. Ignoring service {info.name}")
             return
 
         try:
-            addresses = info.ip_addresses_by_version(IPVersion.V4Only)
-            if not addresses:
-                addresses = info.ip_addresses_by_version(IPVersion.All)
-            
-            if not addresses:
-                return
-            
-            ip_address = addresses[0].exploded
-            port = info.port
+            cached = self._addr_cache.get(name)
+            if cached and cached[0] == info.server and cached[2] == info.port:
+                _, ip_address, port = cached
+            else:
+                addresses = info.ip_addresses_by_version(IPVersion.V4Only)
+                if not addresses:
+                    addresses = info.ip_addresses_by_version(IPVersion.All)
+                
+                if not addresses:
+                    return
+                
+                ip_address = addresses[0].exploded
+                port = info.port
+                
+                # SRV mudou (ex.: nova porta): o endereço antigo não vale mais
+                if cached:
+                    self.connected_devices.discard(f"{cached[1]}:{cached[2]}")
+                self._addr_cache[name] = (info.server, ip_address, port)
 
             # Guardar última porta vista para tentativa oportuna pós-pareamento
             self.last_seen_service = (ip_address, port)
@@ -140,25 +278,16 @@ class AdbConnectListener(ServiceListener):
             for attempt in range(1, max_retries + 1):
                 print(f"[ADB] Connecting to {ip_address}:{port} (attempt {attempt}/{max_retries})...")
                 
-                cmd = ["adb", "connect", f"{ip_address}:{port}"]
+                connected, output = _adb_connect(device_key)
                 
-                process = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=5
-                )
-                
-                output = (process.stdout + process.stderr).lower()
-                
-                if process.returncode == 0 and ("connected" in output or "already connected" in output):
+                if connected:
                     print(f"[ADB] ✓ Connected to {ip_address}:{port}")
                     self.connected_devices.add(device_key)
                     if self.on_connected:
                         self.on_connected(device_key)
                     return
                 else:
-                    print(f"[ADB] Connection failed: {output.strip()}")
+                    print(f"[ADB] Connection failed: {output.decode(errors='replace').strip()}")
                     if attempt < max_retries:
                         time.sleep(2)
             
@@ -183,16 +312,21 @@ class AdbService:
     PAIRING_SERVICE_TYPE = "_adb-tls-pairing._tcp.local."
     CONNECT_SERVICE_TYPE = "_adb-tls-connect._tcp.local."
     
+    # Conexão oportunista pós-pareamento (segundos)
+    OPPORTUNISTIC_WINDOW = 5.0
+    OPPORTUNISTIC_INTERVAL = 0.5
+    OPPORTUNISTIC_ATTEMPT_TIMEOUT = 5.0
+    
     def __init__(self, auto_connect: bool = True):
         self.zeroconf: Zeroconf | None = None
         self.pairing_browser: ServiceBrowser | None = None
         self.connect_browser: ServiceBrowser | None = None
         self.service_name: str = ""
         self.pairing_code: str = ""
-        self.on_paired: Callable[[str], None] | None = None
-        self.on_connected: Callable[[str], None] | None = None
+        self.on_status: Callable[[AdbStatus, str], None] | None = None
         self._running = False
         self._auto_connect = auto_connect
+        self.pairing_listener_instance: AdbPairingListener | None = None
         self.connect_listener_instance: AdbConnectListener | None = None
 
     @property
@@ -217,7 +351,11 @@ class AdbService:
         self.service_name = "adbee"
         
         # Código de 6 dígitos
-        self.pairing_code = str(secrets.randbelow(900000) + 100000)
+        self.pairing_code = f"{secrets.randbelow(1_000_000):06d}"
+        
+        # Browser já ativo: basta trocar o código no listener existente
+        if self.pairing_listener_instance:
+            self.pairing_listener_instance.pairing_code = self.pairing_code
         
         return self.service_name, self.pairing_code
     
@@ -235,32 +373,36 @@ class AdbService:
             print("[Warning] 'adb' command not found in PATH")
             return
         
+        # Browsers já ativos recebem o novo código via generate_credentials
         if self._running:
-            self.stop()
+            return
         
         try:
-            self.zeroconf = Zeroconf()
+            # Uma única instância Zeroconf para toda a vida do app
+            if self.zeroconf is None:
+                self.zeroconf = Zeroconf()
             
             # Wrapper para pareamento
             def _handle_paired(device_ip):
                 print(f"[ADB] Paired with {device_ip}. Triggering opportunistic connection...")
                 # Chamar callback externo
-                if self.on_paired:
-                    self.on_paired(device_ip)
+                if self.on_status:
+                    self.on_status(AdbStatus.PAIRED, device_ip)
                 # Tentar conectar no último serviço visto
                 self.try_connect_last_known()
 
             # Wrapper para conexão
             def _handle_connected(device_ip):
                 print(f"[ADB] Connected to {device_ip}.")
-                if self.on_connected:
-                    self.on_connected(device_ip)
+                if self.on_status:
+                    self.on_status(AdbStatus.CONNECTED, device_ip)
             
             # Browser para pareamento
-            self.pairing_listener_instance = AdbPairingListener(
-                pairing_code=self.pairing_code,
-                on_paired=_handle_paired
-            )
+            if self.pairing_listener_instance is None:
+                self.pairing_listener_instance = AdbPairingListener(
+                    pairing_code=self.pairing_code,
+                    on_paired=_handle_paired
+                )
             
             self.pairing_browser = ServiceBrowser(
                 self.zeroconf,
@@ -269,10 +411,11 @@ class AdbService:
             )
             
             # Browser para conexão
-            self.connect_listener_instance = AdbConnectListener(
-                on_connected=_handle_connected,
-                auto_connect=self._auto_connect
-            )
+            if self.connect_listener_instance is None:
+                self.connect_listener_instance = AdbConnectListener(
+                    on_connected=_handle_connected,
+                    auto_connect=self._auto_connect
+                )
             
             self.connect_browser = ServiceBrowser(
                 self.zeroconf,
@@ -288,58 +431,75 @@ class AdbService:
 
     def try_connect_last_known(self):
         """Try to connect to the last seen connection service immediately by IP:Port."""
-        if hasattr(self, 'connect_listener_instance') and self.connect_listener_instance.last_seen_service:
+        if self.connect_listener_instance and self.connect_listener_instance.last_seen_service:
             ip, port = self.connect_listener_instance.last_seen_service
             print(f"[ADB] Opportunistic connection attempt to {ip}:{port}...")
             
-            cmd = ["adb", "connect", f"{ip}:{port}"]
+            # Chamado a partir da thread do ServiceBrowser, que não tem event loop próprio
+            asyncio.run(self._connect_until_deadline(f"{ip}:{port}"))
+    
+    async def _connect_until_deadline(self, target: str):
+        """
+        Tenta 'adb connect' em intervalos curtos até conectar ou esgotar a janela.
+        
+        Só uma tentativa fica em andamento por vez: a próxima começa quando a
+        atual termina ou o intervalo passa, o que ocorrer por último. Assim um
+        "already connected" nunca vem de uma tentativa concorrente ainda
+        pendente, e o fallback para 'adb connect' não dispara vários
+        subprocessos iniciando o servidor ao mesmo tempo.
+        """
+        # Tentar por 5 segundos, pois o dispositivo pode demorar para abrir a porta após parear
+        deadline = time.monotonic() + self.OPPORTUNISTIC_WINDOW
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            next_start = time.monotonic() + self.OPPORTUNISTIC_INTERVAL
             
-            # Tentar por 5 segundos, pois o dispositivo pode demorar para abrir a porta após parear
-            max_retries = 3
-            for attempt in range(1, max_retries + 1):
-                try:
-                    process = subprocess.run(
-                        cmd,
-                        capture_output=True,
-                        text=True,
-                        timeout=5
-                    )
-                    output = (process.stdout + process.stderr).lower()
-                    
-                    if process.returncode == 0 and ("connected" in output or "already connected" in output):
-                        print(f"[ADB] ✓ Opportunistic connection successful to {ip}:{port}")
-                        if self.on_connected:
-                            self.on_connected(f"{ip}:{port}")
-                        return
-                    else:
-                        print(f"[ADB] Opportunistic connection failed (attempt {attempt}/{max_retries}): {output.strip()}")
-                        if attempt < max_retries:
-                            time.sleep(1.0)
-                            
-                except Exception as e:
-                    print(f"[ADB] Opportunistic connection error: {e}")
-                    if attempt < max_retries:
-                        time.sleep(1.0)
+            if await self._connect_attempt(target, attempt):
+                print(f"[ADB] ✓ Opportunistic connection successful to {target}")
+                if self.on_status:
+                    self.on_status(AdbStatus.CONNECTED, target)
+                return
             
-            print(f"[ADB] Gave up opportunistic connecting to {ip}:{port} after {max_retries} attempts.")
+            # Sem novos disparos após o prazo, mesmo que a thread tenha atrasado
+            if time.monotonic() >= deadline or next_start >= deadline:
+                break
+            await asyncio.sleep(max(0.0, next_start - time.monotonic()))
+        
+        print(f"[ADB] Gave up opportunistic connecting to {target} after {attempt} attempts.")
+    
+    async def _connect_attempt(self, target: str, attempt: int) -> bool:
+        """Uma tentativa de 'adb connect'; retorna True se conectou."""
+        try:
+            connected, output = await asyncio.wait_for(
+                _adb_connect_async(target),
+                timeout=self.OPPORTUNISTIC_ATTEMPT_TIMEOUT
+            )
+        except Exception as e:
+            print(f"[ADB] Opportunistic connection error (attempt {attempt}): {e!r}")
+            return False
+        
+        if not connected:
+            print(f"[ADB] Opportunistic connection failed (attempt {attempt}): {output.decode(errors='replace').strip()}")
+        return connected
     
     def stop(self):
-        """Para os browsers mDNS."""
+        """Para os browsers mDNS, mantendo a instância Zeroconf."""
         for browser in [self.pairing_browser, self.connect_browser]:
             if browser:
-                try:
+                with contextlib.suppress(Exception):
                     browser.cancel()
-                except Exception:
-                    pass
         
         self.pairing_browser = None
         self.connect_browser = None
+        self._running = False
+    
+    def close(self):
+        """Para os browsers e libera a instância Zeroconf (ao encerrar o app)."""
+        self.stop()
         
         if self.zeroconf:
-            try:
+            with contextlib.suppress(Exception):
                 self.zeroconf.close()
-            except Exception:
-                pass
             self.zeroconf = None
-        
-        self._running = False
@@ -7,7 +7,6 @@ gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 
 from gi.repository import Gtk, Gio, Adw, GLib
-from .window import AdbeeWindow
 
 
 class AdbeeApplication(Adw.Application):
@@ -50,6 +49,9 @@ class AdbeeApplication(Adw.Application):
         win = self.props.active_window
         
         if not win:
+            # Import lazily: the template class is only built when a window is needed
+            from .window import AdbeeWindow
+            
             # Create window but don't show it yet
             win = AdbeeWindow(application=self)
             
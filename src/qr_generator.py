@@ -1,21 +1,21 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import io
-import gi
-gi.require_version('GdkPixbuf', '2.0')
-from gi.repository import GdkPixbuf
+import functools
+from typing import NamedTuple
 
 try:
-    import qrcode
-    HAS_QRCODE = True
+    import segno
+    HAS_SEGNO = True
 except ImportError:
-    HAS_QRCODE = False
+    HAS_SEGNO = False
 
-try:
-    import png
-    HAS_PYPNG = True
-except ImportError:
-    HAS_PYPNG = False
+
+class QRImage(NamedTuple):
+    """Raw greyscale (Gdk.MemoryFormat.G8) QR code pixels."""
+    width: int
+    height: int
+    stride: int
+    data: bytes
 
 
 class QRGenerator:
@@ -24,71 +24,51 @@ class QRGenerator:
     def __init__(self):
         self.size = 280
     
-    def generate(self, data: str) -> GdkPixbuf.Pixbuf | None:
+    def generate(self, data: bytes) -> QRImage | None:
         """
         Generate a QR code from the given data.
         
         Args:
-            data: The string to encode in the QR code
+            data: The bytes to encode in the QR code
             
         Returns:
-            GdkPixbuf.Pixbuf or None if generation fails
+            QRImage with one greyscale byte per pixel, or None if
+            generation fails
         """
-        if not HAS_QRCODE:
-            print("Warning: qrcode library not available")
-            return None
-        
-        if not HAS_PYPNG:
-            print("Warning: pypng library not available")
+        if not HAS_SEGNO:
+            print("Warning: segno library not available")
             return None
         
         try:
-            # Criar QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=2,
-            )
-            qr.add_data(data)
-            qr.make(fit=True)
-            
-            # Obter a matriz do QR code
-            matrix = qr.get_matrix()
-            
-            # Calcular tamanho de cada "pixel" do QR code
-            qr_size = len(matrix)
-            box_size = max(1, self.size // qr_size)
-            final_size = box_size * qr_size
-            
-            # Criar imagem PNG usando pypng
-            rows = []
-            for row in matrix:
-                pixel_row = []
-                for cell in row:
-                    # Preto (0) se True, branco (255) se False
-                    color = 0 if cell else 255
-                    # Repetir o pixel box_size vezes
-                    pixel_row.extend([color] * box_size)
-                # Repetir a linha box_size vezes
-                for _ in range(box_size):
-                    rows.append(pixel_row)
-            
-            # Salvar em buffer PNG
-            buffer = io.BytesIO()
-            writer = png.Writer(width=final_size, height=final_size, greyscale=True, bitdepth=8)
-            writer.write(buffer, rows)
-            buffer.seek(0)
-            
-            # Carregar como GdkPixbuf
-            loader = GdkPixbuf.PixbufLoader.new_with_type('png')
-            loader.write(buffer.read())
-            loader.close()
-            
-            return loader.get_pixbuf()
-            
+            return self._generate_raw(data, self.size)
         except Exception as e:
             print(f"Error generating QR code: {e}")
             import traceback
             traceback.print_exc()
             return None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _generate_raw(data: bytes, size: int) -> QRImage:
+        """Encode and upscale the QR code; cached by (data, size)."""
+        # Criar QR code (menor versão possível, correção de erro L)
+        qr = segno.make(data, error='l', boost_error=False, micro=False)
+        
+        # Obter a matriz do QR code, já com a borda
+        matrix = list(qr.matrix_iter(scale=1, border=2))
+        
+        # Calcular tamanho de cada "pixel" do QR code
+        qr_size = len(matrix)
+        box_size = max(1, size // qr_size)
+        final_size = box_size * qr_size
+        
+        # Blocos já escalados: preto (0) se escuro, branco (255) se claro
+        runs = (b'\xff' * box_size, b'\x00' * box_size)
+        
+        # Cada linha é montada uma vez e repetida box_size vezes
+        buf = b''.join(
+            b''.join([runs[cell] for cell in row]) * box_size
+            for row in matrix
+        )
+        
+        return QRImage(final_size, final_size, final_size, buf)
@@ -1,12 +1,24 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import gi
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 
 from gi.repository import Gtk, Adw, GLib, Gio, Gdk
-from .adb_service import AdbService
-from .qr_generator import QRGenerator
+from .adb_service import AdbService, AdbStatus
+from .qr_generator import QRGenerator, QRImage
+
+logger = logging.getLogger(__name__)
+
+# Cabeçalho fixo do QR de pareamento: WIFI:T:ADB;S:<nome>;P:<código>;;
+_WIFI_PREFIX = b"WIFI:T:ADB;S:"
+
+# Proxy do portal de background, compartilhado entre janelas
+_BG_PROXY: Gio.DBusProxy | None = None
 
 
 @Gtk.Template(resource_path='/io/github/docmine17/adbee/window.ui')
@@ -22,17 +34,43 @@ class AdbeeWindow(Adw.ApplicationWindow):
     generate_button: Gtk.Button = Gtk.Template.Child()
     toast_overlay: Adw.ToastOverlay = Gtk.Template.Child()
     
+    # Argumentos de RequestBackground, montados na primeira chamada
+    _bg_request_args: GLib.Variant | None = None
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         
         self.settings = Gio.Settings(schema_id='io.github.docmine17.adbee')
         
+        # Strings traduzidas resolvidas uma vez (o locale não muda em execução)
+        self._msg_waiting = _("Waiting for device to scan QR code...")
+        self._msg_paired = _("Paired! Waiting for connection...")
+        self._msg_connected = _("Device connected successfully!")
+        self._msg_connected_toast = _("✓ Connected to %s")
+        
+        # Callbacks vindos desta thread podem atualizar a UI diretamente
+        self._main_thread = threading.get_ident()
+        
         self.adb_service = AdbService(auto_connect=self.settings.get_boolean("auto-connect"))
         self.qr_generator = QRGenerator()
         
+        # Geração do QR fora da main thread; _qr_gen descarta respostas antigas
+        self._qr_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qr-gen")
+        self._qr_gen = 0
+        
+        # Classes do status_label definidas no template (ex.: dim-label)
+        self._status_classes = self.status_label.get_css_classes()
+        success_classes = self._status_classes + ["success"]
+        
+        # (texto do status, classes CSS, toast ou None), indexado por AdbStatus
+        self._status_table = (
+            (self._msg_waiting, self._status_classes, None),
+            (self._msg_paired, success_classes, None),
+            (self._msg_connected, success_classes, self._msg_connected_toast),
+        )
+        
         # Conectar callbacks
-        self.adb_service.on_paired = self.on_device_paired
-        self.adb_service.on_connected = self.on_device_connected
+        self.adb_service.on_status = self.on_status
         self.settings.connect("changed::auto-connect", self.on_auto_connect_changed)
         
         # Gerar QR code inicial
@@ -43,6 +81,7 @@ class AdbeeWindow(Adw.ApplicationWindow):
         
         # Interceptar fechamento da janela
         self.connect('close-request', self.on_close_request)
+        self.connect('destroy', self.on_destroy)
     
     def on_auto_connect_changed(self, settings, key):
         """Update service when setting changes."""
@@ -55,103 +94,172 @@ class AdbeeWindow(Adw.ApplicationWindow):
     
     def generate_new_pairing(self):
         """Generate a new pairing code and QR code."""
-        # Parar serviço anterior se existir
-        self.adb_service.stop()
-        
         # Gerar novo código
         service_name, pairing_code = self.adb_service.generate_credentials()
         
         # Atualizar labels
         self.service_name_label.set_label(service_name)
         self.pairing_code_label.set_label(pairing_code)
-        self.status_label.set_label(_("Waiting for device to scan QR code..."))
-        self.status_label.remove_css_class("success")
-        self.status_label.remove_css_class("error")
-        
-        # Gerar QR code
-        qr_data = f"WIFI:T:ADB;S:{service_name};P:{pairing_code};;"
-        pixbuf = self.qr_generator.generate(qr_data)
-        
-        if pixbuf:
-            # Usar método não-deprecated para criar texture
-            success, png_data = pixbuf.save_to_bufferv('png', [], [])
-            if success:
-                texture = Gdk.Texture.new_from_bytes(GLib.Bytes.new(png_data))
-                self.qr_picture.set_paintable(texture)
-        
-        # Iniciar serviço mDNS
+        self._apply_status(AdbStatus.WAITING, "")
+        
+        # Gerar QR code em segundo plano; _apply_qr_texture exibe o resultado
+        qr_data = (
+            _WIFI_PREFIX + service_name.encode('ascii')
+            + b";P:" + pairing_code.encode('ascii') + b";;"
+        )
+        self._qr_gen += 1
+        self._qr_pool.submit(self._qr_worker, self._qr_gen, qr_data)
+        
+        # Não mostrar o QR antigo enquanto o novo é gerado
+        self.qr_picture.set_paintable(None)
+        
+        # Iniciar serviço mDNS (no-op se já estiver rodando)
         self.adb_service.start()
     
-    def on_device_paired(self, device_name: str):
-        """Callback when a device is successfully paired."""
-        GLib.idle_add(self._update_paired_status, device_name)
-    
-    def on_device_connected(self, device_name: str):
-        """Callback when a device is successfully connected."""
-        GLib.idle_add(self._update_connected_status, device_name)
+    def _qr_worker(self, gen: int, qr_data: bytes):
+        """Gera os pixels do QR em uma thread de trabalho."""
+        image = self.qr_generator.generate(qr_data)
+        GLib.idle_add(self._apply_qr_texture, gen, image)
     
-    def _update_paired_status(self, device_name: str):
-        """Update UI to show paired status (waiting for connection)."""
-        self.status_label.set_label(_("Paired! Waiting for connection..."))
-        self.status_label.add_css_class("success")
+    def _apply_qr_texture(self, gen: int, image: QRImage | None):
+        """Cria a textura na main thread e a exibe se ainda for a mais recente."""
+        if image and gen == self._qr_gen:
+            # Criar texture direto dos pixels, sem passar por PNG
+            texture = Gdk.MemoryTexture.new(
+                image.width, image.height, Gdk.MemoryFormat.G8,
+                GLib.Bytes.new(image.data), image.stride
+            )
+            self.qr_picture.set_paintable(texture)
+        
         return False
-
-    def _update_connected_status(self, device_name: str):
-        """Update UI to show connected status."""
-        self.status_label.set_label(_("Device connected successfully!"))
+    
+    def on_status(self, state: AdbStatus, device_name: str):
+        """Callback for every pairing/connection state change."""
+        if threading.get_ident() == self._main_thread:
+            self._apply_status(state, device_name)
+        else:
+            GLib.idle_add(self._apply_status, state, device_name)
+    
+    def _apply_status(self, state: AdbStatus, device_name: str):
+        """Update status_label (and show a toast, if any) for the given state."""
+        text, css_classes, toast_text = self._status_table[state]
         
-        toast = Adw.Toast.new(f"✓ Connected to {device_name}")
-        toast.set_timeout(5)
-        self.toast_overlay.add_toast(toast)
+        label = self.status_label
+        label.freeze_notify()
+        # Só recalcular o estilo se as classes mudarem
+        if label.get_css_classes() != css_classes:
+            label.set_css_classes(css_classes)
+        label.set_label(text)
+        label.thaw_notify()
+        
+        if toast_text:
+            toast = Adw.Toast.new(toast_text % device_name)
+            toast.set_timeout(5)
+            self.toast_overlay.add_toast(toast)
         
         return False
 
     def request_background(self):
-        """Solicita permissão para rodar em segundo plano."""
+        """Solicita permissão para rodar em segundo plano (assíncrono)."""
+        # Até o portal responder, fechar a janela encerra o app
+        self.background_enabled = False
+        
+        if _BG_PROXY:
+            self._call_request_background(_BG_PROXY)
+            return
+        
+        # Reaproveitar a conexão D-Bus que o Gio.Application já mantém
+        app = self.get_application()
+        bus = app.get_dbus_connection() if app else None
+        if bus:
+            self._create_background_proxy(bus)
+        else:
+            Gio.bus_get(Gio.BusType.SESSION, None, self._on_bus_ready)
+    
+    def _on_bus_ready(self, source, result):
+        """Cria o proxy do portal assim que o session bus estiver disponível."""
         try:
-            bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
-            proxy = Gio.DBusProxy.new_sync(
-                bus,
-                Gio.DBusProxyFlags.NONE,
-                None,
-                "org.freedesktop.portal.Desktop",
-                "/org/freedesktop/portal/desktop",
-                "org.freedesktop.portal.Background",
-                None
-            )
-            
-            # Chamada síncrona ao portal
-            # RequestBackground(parent_window, options) -> handle
-            proxy.call_sync(
-                "RequestBackground",
-                GLib.Variant("(sa{sv})", (
-                    "",
-                    {
-                        "reason": GLib.Variant("s", _("Keep ADB connections active")),
-                        "autostart": GLib.Variant("b", True),
-                        "commandline": GLib.Variant("as", ['adbee', '--background']),
-                    }
-                )),
-                Gio.DBusCallFlags.NONE,
-                -1,
-                None
-            )
-            
-            print("[Background] Permission requested successfully")
-            self.background_enabled = True
-            
+            bus = Gio.bus_get_finish(result)
+        except Exception as e:
+            self._on_background_failed(e)
+            return
+        
+        self._create_background_proxy(bus)
+    
+    def _create_background_proxy(self, bus: Gio.DBusConnection):
+        """Cria o proxy do portal de background de forma assíncrona."""
+        Gio.DBusProxy.new(
+            bus,
+            Gio.DBusProxyFlags.NONE,
+            None,
+            "org.freedesktop.portal.Desktop",
+            "/org/freedesktop/portal/desktop",
+            "org.freedesktop.portal.Background",
+            None,
+            self._on_proxy_ready
+        )
+    
+    def _on_proxy_ready(self, source, result):
+        """Guarda o proxy para as próximas janelas e faz a requisição."""
+        global _BG_PROXY
+        try:
+            _BG_PROXY = Gio.DBusProxy.new_finish(result)
+        except Exception as e:
+            self._on_background_failed(e)
+            return
+        
+        self._call_request_background(_BG_PROXY)
+    
+    def _call_request_background(self, proxy: Gio.DBusProxy):
+        """Chama RequestBackground(parent_window, options) -> handle no portal."""
+        cls = type(self)
+        if cls._bg_request_args is None:
+            cls._bg_request_args = GLib.Variant("(sa{sv})", (
+                "",
+                {
+                    "reason": GLib.Variant("s", _("Keep ADB connections active")),
+                    "autostart": GLib.Variant("b", True),
+                    "commandline": GLib.Variant("as", ['adbee', '--background']),
+                }
+            ))
+        
+        proxy.call(
+            "RequestBackground",
+            cls._bg_request_args,
+            Gio.DBusCallFlags.NONE,
+            -1,
+            None,
+            self._on_background_ready
+        )
+    
+    def _on_background_ready(self, proxy, result):
+        """Resultado da chamada RequestBackground."""
+        try:
+            proxy.call_finish(result)
         except Exception as e:
-            import traceback
-            traceback.print_exc()
-            print(f"[Background] Failed to request background: {e!r}")
-            if isinstance(e, GLib.Error):
-                print(f"[Background] GError code: {e.code}, domain: {e.domain}")
-            self.background_enabled = False
+            self._on_background_failed(e)
+            return
+        
+        logger.info("Background permission requested")
+        self.background_enabled = True
+    
+    def _on_background_failed(self, e: Exception):
+        """Registra a falha; deve ser chamado dentro do bloco except."""
+        if isinstance(e, GLib.Error):
+            logger.exception("Background request failed (GError code %s, domain %s)", e.code, e.domain)
+        else:
+            logger.exception("Background request failed")
+        self.background_enabled = False
 
     def on_close_request(self, *args):
         """Ao fechar a janela, esconde se tiver permissão de background."""
         if getattr(self, 'background_enabled', False):
-            print("[Background] Hiding window instead of closing")
+            logger.debug("Hiding window instead of closing")
             self.set_visible(False)
             return True # Retornar True impede a destruição da janela
         return False # Comportamento padrão (destruir)
+
+    def on_destroy(self, *args):
+        """Libera o Zeroconf e a thread do QR quando a janela é destruída."""
+        self._qr_pool.shutdown(wait=False, cancel_futures=True)
+        self.adb_service.close()
@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import threading
+import time
+import unittest
+
+try:
+    from src import adb_service
+except ImportError:  # zeroconf ausente
+    adb_service = None
+
+
+@unittest.skipIf(adb_service is None, "zeroconf not available")
+class ConnectUntilDeadlineTest(unittest.TestCase):
+    """Testes do laço de conexão oportunista pós-pareamento."""
+
+    def make_service(self):
+        service = adb_service.AdbService()
+        service.OPPORTUNISTIC_WINDOW = 0.3
+        service.OPPORTUNISTIC_INTERVAL = 0.05
+        return service
+
+    def run_loop(self, service, timeout=3.0):
+        thread = threading.Thread(
+            target=asyncio.run,
+            args=(service._connect_until_deadline("1.2.3.4:5555"),),
+            daemon=True,
+        )
+        thread.start()
+        thread.join(timeout)
+        return thread
+
+    def test_stall_across_deadline_terminates(self):
+        service = self.make_service()
+        attempts = []
+
+        async def attempt(target, n):
+            attempts.append(n)
+            if n == 3:
+                # Bloqueia o event loop além do prazo (GIL, SIGSTOP, VM pausada...)
+                time.sleep(0.4)
+            return False
+
+        service._connect_attempt = attempt
+        thread = self.run_loop(service)
+
+        self.assertFalse(thread.is_alive(), "loop did not stop after the deadline")
+        self.assertEqual(attempts[-1], 3)
+
+    def test_single_attempt_in_flight(self):
+        service = self.make_service()
+        in_flight = 0
+        max_in_flight = 0
+        starts = []
+
+        async def attempt(target, n):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            starts.append(time.monotonic())
+            # Mais lenta que o intervalo: a próxima deve esperar esta terminar
+            await asyncio.sleep(0.12)
+            in_flight -= 1
+            return False
+
+        service._connect_attempt = attempt
+        thread = self.run_loop(service)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(max_in_flight, 1)
+        self.assertGreater(len(starts), 1)
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        self.assertTrue(all(gap >= 0.12 for gap in gaps), gaps)
+
+    def test_reports_connected_on_success(self):
+        service = self.make_service()
+        statuses = []
+        service.on_status = lambda state, device: statuses.append((state, device))
+
+        async def attempt(target, n):
+            return n == 2
+
+        service._connect_attempt = attempt
+        thread = self.run_loop(service)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(statuses, [(adb_service.AdbStatus.CONNECTED, "1.2.3.4:5555")])
+
+
+if __name__ == '__main__':
+    unittest.main()